@@ -5,7 +5,42 @@ from typing import NamedTuple
 import numpy as np
 import scenepic as sp
 
-from .position import Axis, Direction, PLACES, Position
+from .position import AXES, Axis, DELTAS, Direction, PLACE_NAMES, Position
+
+
+def _rotation(axis: Axis, orientation: int) -> np.ndarray:
+    """Compute the rotation of a piece along an axis in the given orientation."""
+    n = orientation
+    flipped = False
+    if n > 3:
+        n -= 4
+        if n > 3:
+            raise ValueError("Invalid orientation")
+
+        flipped = True
+
+    transform = np.eye(4)
+    if flipped:
+        transform = sp.Transforms.rotation_about_y(np.pi)
+
+    if n > 0:
+        angle = np.pi * n / 2
+        transform = sp.Transforms.rotation_about_z(angle) @ transform
+
+    if axis == Axis.Y:
+        transform = sp.Transforms.rotation_about_x(np.pi / 2) @ transform
+
+    if axis == Axis.X:
+        transform = sp.Transforms.rotation_about_y(np.pi / 2) @ transform
+
+    # quarter turns only have entries of -1, 0 and 1, so rounding removes the
+    # floating point noise from the trigonometry, and adding zero clears any
+    # negative zeros
+    return np.round(transform) + 0.0
+
+
+"""Rotation of a piece, indexed by axis and then orientation."""
+ROTATIONS = [[_rotation(axis, o) for o in range(8)] for axis in AXES]
 
 
 class Piece(NamedTuple("Piece", [("shape", int), ("position", Position),
@@ -29,35 +64,16 @@ class Piece(NamedTuple("Piece", [("shape", int), ("position", Position),
         Returns:
             The result of moving the piece.
         """
-        return Piece(self.shape, self.position.move(d, steps), self.orientation)
+        x, y, z, axis = self.position
+        dx, dy, dz = DELTAS[d]
+        return Piece(self.shape, Position(x + dx * steps, y + dy * steps, z + dz * steps, axis),
+                     self.orientation)
 
     def to_transform(self) -> np.ndarray:
         """Convert the piece to a transformation matrix."""
-        n = self.orientation
-        flipped = False
-        if n > 3:
-            n -= 4
-            if n > 3:
-                raise ValueError("Invalid orientation")
-
-            flipped = True
-
-        transform = np.eye(4)
-        if flipped:
-            transform = sp.Transforms.rotation_about_y(np.pi)
-
-        if n > 0:
-            angle = np.pi * n / 2
-            transform = sp.Transforms.rotation_about_z(angle) @ transform
-
         x, y, z, axis = self.position
-        if axis == Axis.Y:
-            transform = sp.Transforms.rotation_about_x(np.pi / 2) @ transform
-
-        if axis == Axis.X:
-            transform = sp.Transforms.rotation_about_y(np.pi / 2) @ transform
-
-        transform = sp.Transforms.translate([x, y, z]) @ transform
+        transform = ROTATIONS[AXES.index(axis)][self.orientation].copy()
+        transform[:3, 3] = (x, y, z)
         return transform
 
     def __str__(self) -> str:
@@ -77,17 +93,19 @@ class Piece(NamedTuple("Piece", [("shape", int), ("position", Position),
         would be the same piece at (1, 2, 3).
         """
         o = chr(97 + self.orientation)
-        if self.position == PLACES["A"]:
-            return "A{}{}".format(self.shape + 1, o)
-        if self.position == PLACES["B"]:
-            return "B{}{}".format(self.shape + 1, o)
-        if self.position == PLACES["C"]:
-            return "C{}{}".format(self.shape + 1, o)
-        if self.position == PLACES["D"]:
-            return "D{}{}".format(self.shape + 1, o)
-        if self.position == PLACES["E"]:
-            return "E{}{}".format(self.shape + 1, o)
-        if self.position == PLACES["F"]:
-            return "F{}{}".format(self.shape + 1, o)
-
-        return "{}{}{}".format(self.position, self.shape + 1, o)
+        name = PLACE_NAMES.get(self.position)
+        if name is None:
+            return f"{self.position}{self.shape + 1}{o}"
+
+        return f"{name}{self.shape + 1}{o}"
+
+
+def pack_piece(piece: Piece) -> int:
+    """Pack a piece at an integer position into a single int.
+
+    Packed pieces hash and compare as cheaply as any other int. Each
+    coordinate of the position must lie within [-16, 16).
+    """
+    x, y, z, axis = piece.position
+    return (((((piece.shape * 32 + x + 16) * 32 + y + 16) * 32 + z + 16) * 4
+             + AXES.index(axis)) * 8 + piece.orientation)
@@ -14,6 +14,17 @@ class Direction(IntEnum):
     RIGHT = 5
 
 
+"""Unit step along each axis for each direction, indexed by direction."""
+DELTAS = (
+    (0, 0, 1),
+    (0, 0, -1),
+    (0, 1, 0),
+    (0, -1, 0),
+    (-1, 0, 0),
+    (1, 0, 0),
+)
+
+
 class Axis(Enum):
     """Axis for piece alignment."""
     X = "X"
@@ -21,6 +32,10 @@ class Axis(Enum):
     Z = "Z"
 
 
+"""All axes, in a fixed order."""
+AXES = (Axis.X, Axis.Y, Axis.Z)
+
+
 class Position(NamedTuple("Position", [("x", int), ("y", int), ("z", int),
                                        ("axis", Axis)])):
     """Position of a piece in the puzzle."""
@@ -35,42 +50,8 @@ class Position(NamedTuple("Position", [("x", int), ("y", int), ("z", int),
         Returns:
             The new position of the piece after moving.
         """
-        if d == Direction.UP:
-            return self.up(steps)
-        elif d == Direction.DOWN:
-            return self.down(steps)
-        elif d == Direction.LEFT:
-            return self.left(steps)
-        elif d == Direction.RIGHT:
-            return self.right(steps)
-        elif d == Direction.FORWARD:
-            return self.forward(steps)
-        elif d == Direction.BACKWARD:
-            return self.back(steps)
-
-    def up(self, steps: int) -> "Position":
-        """Move the position up by the given number of steps."""
-        return Position(self.x, self.y + steps, self.z, self.axis)
-
-    def down(self, steps: int) -> "Position":
-        """Move the position down by the given number of steps."""
-        return Position(self.x, self.y - steps, self.z, self.axis)
-
-    def left(self, steps: int) -> "Position":
-        """Move the position left by the given number of steps."""
-        return Position(self.x - steps, self.y, self.z, self.axis)
-
-    def right(self, steps: int) -> "Position":
-        """Move the position right by the given number of steps."""
-        return Position(self.x + steps, self.y, self.z, self.axis)
-
-    def forward(self, steps: int) -> "Position":
-        """Move the position forward by the given number of steps."""
-        return Position(self.x, self.y, self.z + steps, self.axis)
-
-    def back(self, steps: int) -> "Position":
-        """Move the position back by the given number of steps."""
-        return Position(self.x, self.y, self.z - steps, self.axis)
+        dx, dy, dz = DELTAS[d]
+        return Position(self.x + dx * steps, self.y + dy * steps, self.z + dz * steps, self.axis)
 
     def __str__(self) -> str:
         """Return a string representation of the position."""
@@ -86,3 +67,9 @@ PLACES = {
     "D": Position(0, 0, 1, Axis.X),
     "F": Position(0, 1, 0, Axis.Z),
 }
+
+"""Name of each named location in the puzzle, keyed by position."""
+PLACE_NAMES = {position: name for name, position in PLACES.items()}
+
+"""Index of each named location in the puzzle, keyed by position."""
+PLACE_INDEX = {position: i for i, position in enumerate(PLACES.values())}
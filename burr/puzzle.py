@@ -1,60 +1,211 @@
 """A six-piece burr puzzle."""
 
+from functools import lru_cache
 from itertools import combinations
-from typing import List, NamedTuple, Set, Tuple
+from typing import List, NamedTuple, Sequence, Tuple
 
-from .piece import Piece
-from .position import Direction, PLACES
+import numpy as np
+
+from .piece import pack_piece, Piece
+from .position import DELTAS, Direction, PLACE_INDEX, PLACES
 from .shape import Shape
-from .voxel import Voxel
+from .voxel import INSIDE_MASK, shift_mask, Voxel
 
 
 class PuzzleState(NamedTuple("PuzzleState", [("pieces", Tuple[Piece]),
-                                             ("voxels", Set[Voxel])])):
-    """The state of the puzzle."""
+                                             ("voxels", int)])):
+    """The state of the puzzle.
+
+    The voxels occupied by the pieces are stored as an occupancy bitmask.
+    """
 
-    def add(self, piece: Piece, voxels: Set[Voxel]) -> "PuzzleState":
+    def add(self, piece: Piece, mask: int) -> "PuzzleState":
         """Add a piece to the puzzle state."""
-        return PuzzleState(self.pieces + (piece,), self.voxels.union(voxels))
+        return PuzzleState(self.pieces + (piece,), self.voxels | mask)
+
+    def score(self) -> int:
+        """Return the total number of voxels inside the puzzle."""
+        return (self.voxels & INSIDE_MASK).bit_count()
+
+    def key(self) -> Tuple[int, ...]:
+        """Return a hashable key for the state, with each piece packed into an int."""
+        return tuple([pack_piece(p) for p in self.pieces])
 
     def __str__(self) -> str:
         """Return a string representation of the puzzle state."""
         return " ".join([str(p) for p in self.pieces])
 
 
-"""A move in the puzzle."""
-Move = NamedTuple("Move", [("pieces", Set[Piece]),
+"""A move in the puzzle.
+
+The pieces which move are given as a bitmap of their indices in the puzzle.
+"""
+Move = NamedTuple("Move", [("piece_mask", int),
                   ("direction", Direction), ("steps", int)])
 
 
+"""All directions in which pieces can move."""
+DIRECTIONS = tuple(Direction)
+
+"""Repeats a bitmap of pieces once for every direction."""
+_EVERY_DIRECTION = sum(1 << (8 * d) for d in DIRECTIONS)
+
+
+@lru_cache(maxsize=None)
+def _subsets(num_pieces: int, num_shapes: int) -> Tuple[Tuple[int, ...], ...]:
+    """Return the indices of the pieces in each subset which may move together."""
+    if num_pieces > num_shapes // 2:
+        # We may need to move more than one piece simultaneously
+        sizes = range(1, num_pieces // 2 + 1)
+    else:
+        sizes = [1]
+
+    subsets = []
+    for size in sizes:
+        subsets.extend(combinations(range(num_pieces), size))
+
+    return tuple(subsets)
+
+
+def _blockers(piece_masks: Sequence[int]) -> List[int]:
+    """Find which pieces block each piece from moving a single step.
+
+    Args:
+        piece_masks: The occupancy bitmask of each piece.
+
+    Returns:
+        For each piece, the indices of the other pieces it would collide
+        with after one step as a bitmap, with one byte per direction.
+    """
+    blockers = []
+    for i, mask in enumerate(piece_masks):
+        blocked = 0
+        for d in DIRECTIONS:
+            moved = shift_mask(mask, d)
+            for j, other in enumerate(piece_masks):
+                if j != i and moved & other:
+                    blocked |= 1 << (8 * d + j)
+
+        blockers.append(blocked)
+
+    return blockers
+
+
+def _valid_moves_kernel(piece_masks: Sequence[int],
+                        subsets: Sequence[Tuple[int, ...]]) -> List[Tuple[int, Direction, int]]:
+    """Find all valid moves for subsets of pieces.
+
+    This operates purely on occupancy bitmasks, so no objects are created
+    while sliding a subset through the puzzle. Almost every subset is
+    blocked after a single step, so the pieces blocking each piece are
+    found first and a subset is only slid in the directions in which it is
+    not held in place by a piece outside of the subset.
+
+    Args:
+        piece_masks: The occupancy bitmask of each piece.
+        subsets: The indices of the pieces in each subset.
+
+    Returns:
+        A (piece bitmap, direction, steps) tuple for each valid move.
+    """
+    voxels_mask = 0
+    for mask in piece_masks:
+        voxels_mask |= mask
+
+    blockers = _blockers(piece_masks)
+    moves = []
+    for subset in subsets:
+        subset_bits = 0
+        blocked = 0
+        for i in subset:
+            subset_bits |= 1 << i
+            blocked |= blockers[i]
+
+        # Only pieces outside of the subset can block it
+        blocked &= ~(subset_bits * _EVERY_DIRECTION)
+        subset_mask = None
+        for d in DIRECTIONS:
+            if (blocked >> (8 * d)) & 0xFF:
+                continue
+
+            if subset_mask is None:
+                subset_mask = 0
+                for i in subset:
+                    subset_mask |= piece_masks[i]
+
+                # Find all voxels not occupied by the subset
+                old_mask = voxels_mask & ~subset_mask
+
+            # The subset can move at least one step, so keep going until it
+            # is blocked or has left the puzzle
+            steps = 1
+            moved = shift_mask(subset_mask, d)
+            is_outside = (moved & INSIDE_MASK) == 0
+            while not is_outside:
+                moved = shift_mask(moved, d)
+                if moved & old_mask:
+                    break
+
+                steps += 1
+                is_outside = (moved & INSIDE_MASK) == 0
+
+            if not is_outside:
+                # If the pieces are still in the puzzle we have
+                # to go by a single step
+                steps = 1
+
+            moves.append((subset_bits, d, steps))
+
+    return moves
+
+
 class Puzzle(NamedTuple("Puzzle", [("shapes", Tuple[Shape]),
                                    ("pieces", Tuple[Piece]),
-                                   ("voxels", Set[Voxel])])):
-    """A six-piece burr puzzle."""
+                                   ("voxels", int),
+                                   ("masks", Tuple[int, ...]),
+                                   ("placements", Tuple[Tuple[List[Tuple[Piece, int]], ...], ...])])):
+    """A six-piece burr puzzle.
+
+    The occupancy bitmask of each piece is computed once when the puzzle is
+    created and stored in the same order as the pieces, along with the
+    combined bitmask of all occupied voxels. The valid pieces for each
+    shape at each named location are also computed once, as the assembly
+    search asks for them repeatedly. These are indexed by shape and then by
+    place index.
+    """
 
     @staticmethod
     def from_text(lines: List[str]) -> "Puzzle":
         """Create a puzzle from a list of shape strings."""
         shapes = []
-        for line in lines:
-            shapes.append(Shape.from_text(line))
+        placements = []
+        for s, line in enumerate(lines):
+            shape = Shape.from_text(line)
+            shapes.append(shape)
+            placements.append(tuple([[(Piece(s, position, vs.orientation), vs.mask)
+                                      for vs in shape.orientations[place]]
+                                     for place, position in PLACES.items()]))
 
-        return Puzzle(tuple(shapes), [], set())
+        return Puzzle(tuple(shapes), [], 0, (), tuple(placements))
 
     def order_by_size(self) -> List[int]:
         """Order the shapes by size."""
         return sorted(range(len(self.shapes)),
-                      key=lambda s: -len(self.shapes[s].voxels))
+                      key=lambda s: -self.shapes[s].size)
 
     def order_by_orientations(self) -> List[int]:
         """Order the shapes by the number of valid orientations."""
         return sorted(range(len(self.shapes)),
-                      key=lambda s: len(self.shapes[s].orientations["A"]))
+                      key=lambda s: self.shapes[s].num_orientations)
+
+    def pieces_at(self, s: int, place: str) -> List[Tuple[Piece, int]]:
+        """Return all valid pieces and their bitmasks for a shape at a named location."""
+        return self.placements[s][PLACE_INDEX[PLACES[place]]]
 
-    def pieces_at(self, s: int, place: str) -> List[Tuple[Piece, Set[Voxel]]]:
-        """Return all valid piece states for a shape at a named location."""
-        return [(Piece(s, PLACES[place], vs.orientation), vs.voxels)
-                for vs in self.shapes[s].orientations[place]]
+    def pieces_at_unflipped(self, s: int, place: str) -> List[Tuple[Piece, int]]:
+        """Return the valid pieces which are not flipped for a shape at a named location."""
+        return [(piece, mask) for piece, mask in self.pieces_at(s, place)
+                if not piece.is_flipped()]
 
     def state(self) -> PuzzleState:
         """Return the current state of the puzzle."""
@@ -62,7 +213,8 @@ class Puzzle(NamedTuple("Puzzle", [("shapes", Tuple[Shape]),
 
     def to_state(self, state: PuzzleState) -> "Puzzle":
         """Return a new puzzle with the given state."""
-        return Puzzle(self.shapes, state.pieces, state.voxels)
+        return Puzzle(self.shapes, state.pieces, state.voxels,
+                      tuple([self.mask_for(p) for p in state.pieces]), self.placements)
 
     def inside_count(self, p: Piece) -> int:
         """Return the number of voxels inside the puzzle for a piece."""
@@ -70,29 +222,72 @@ class Puzzle(NamedTuple("Puzzle", [("shapes", Tuple[Shape]),
 
     def score(self) -> int:
         """Return the total number of voxels inside the puzzle."""
-        return sum(v.is_inside() for v in self.voxels)
+        return (self.voxels & INSIDE_MASK).bit_count()
 
     def move(self, move: Move) -> "Puzzle":
         """Move the pieces in the puzzle."""
         new_pieces = []
-        new_voxels = self.voxels.copy()
-        for piece in self.pieces:
-            if piece in move.pieces:
-                new_voxels.difference_update(self.voxels_for(piece))
-                new_piece = piece.move(move.direction, move.steps)
-                new_shape = self.shapes[piece.shape].aligned_at(new_piece)
-                if new_shape.inside_count() > 0:
-                    new_pieces.append(new_piece)
-                    new_voxels.update(new_shape.voxels)
-            else:
-                new_pieces.append(piece)
-
-        return Puzzle(self.shapes, tuple(new_pieces), new_voxels)
+        new_masks = []
+        new_voxels = 0
+        for i, (piece, mask) in enumerate(zip(self.pieces, self.masks)):
+            if (move.piece_mask >> i) & 1:
+                piece = piece.move(move.direction, move.steps)
+                mask = self.mask_for(piece)
+                if (mask & INSIDE_MASK) == 0:
+                    continue
+
+            new_pieces.append(piece)
+            new_masks.append(mask)
+            new_voxels |= mask
+
+        return Puzzle(self.shapes, tuple(new_pieces), new_voxels, tuple(new_masks),
+                      self.placements)
+
+    def move_batch(self, pieces: Sequence[Piece], d: Direction,
+                   steps: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """Move pieces in the puzzle by several numbers of steps at once.
+
+        This is used to animate a move, where the same pieces are moved by a
+        fraction of a step for every frame. The pieces must be at whole-step
+        positions, as they are in every state of a disassembly.
+
+        Args:
+            pieces: The P pieces to move.
+            d: The direction to move the pieces.
+            steps: The N numbers of steps to move the pieces.
+
+        Returns:
+            The (N, P, 4, 4) transforms of the pieces after moving by each
+            number of steps and an (N, P) array indicating whether each moved
+            piece is still inside the puzzle.
+        """
+        steps = np.asarray(steps, np.float64)
+        transforms = np.stack([p.to_transform() for p in pieces])
+        transforms = np.repeat(transforms[np.newaxis], len(steps), axis=0)
+        transforms[:, :, :3, 3] += steps[:, np.newaxis, np.newaxis] * DELTAS[d]
+
+        # Voxel centers lie half way between the grid lines, so moving by a
+        # fraction of a step moves the aligned voxels by that fraction rounded
+        # half towards the direction of the move, and the bitmask of each piece
+        # can be shifted by whole steps instead of aligning its voxels again
+        if sum(DELTAS[d]) > 0:
+            whole_steps = np.floor(0.5 + steps)
+        else:
+            whole_steps = -np.floor(0.5 - steps)
+
+        masks = [self.mask_for(p) for p in pieces]
+        is_inside = np.array([[(shift_mask(mask, d, n) & INSIDE_MASK) != 0 for mask in masks]
+                              for n in whole_steps.astype(np.int64).tolist()], bool)
+        return transforms, is_inside.reshape(len(steps), len(pieces))
 
     def voxels_for(self, piece: Piece) -> List[Voxel]:
         """Return the voxels for a piece."""
         return self.shapes[piece.shape].aligned_at(piece).voxels
 
+    def mask_for(self, piece: Piece) -> int:
+        """Return the occupancy bitmask for a piece."""
+        return self.shapes[piece.shape].aligned_at(piece).mask
+
     def level(self) -> int:
         """Return the level of the puzzle.
 
@@ -100,61 +295,20 @@ class Puzzle(NamedTuple("Puzzle", [("shapes", Tuple[Shape]),
         "voids" in the puzzle, that is, empty spaces in the hidden
         center. The level is 1 + the number of voids.
         """
-        num_voxels = sum([len(s.voxels) for s in self.shapes])
+        num_voxels = sum([s.size for s in self.shapes])
         return 105 - num_voxels
 
     def can_place(self, piece: Piece) -> bool:
         """Check if a piece can be validly placed in the puzzle."""
-        return self.voxels.isdisjoint(self.voxels_for(piece))
+        return (self.voxels & self.mask_for(piece)) == 0
 
     def valid_moves(self) -> List[List[PuzzleState]]:
         """Return all valid moves for the puzzle."""
         states = []
-        if len(self.pieces) > len(self.shapes) // 2:
-            # We may need to move more than one piece simultaneously
-            sizes = list(range(1, len(self.pieces) // 2 + 1))
-        else:
-            sizes = [1]
-
-        for size in sizes:
-            for subset in combinations(self.pieces, size):
-                # Find all voxels not occupied by the subset
-                subset_voxels: Set[Voxel] = set()
-                for p in subset:
-                    subset_voxels.update(self.voxels_for(p))
-
-                old_voxels = self.voxels.difference(subset_voxels)
-
-                for d in Direction:
-                    # Try moving the subset in the given direction
-                    can_move = True
-                    is_outside = False
-                    steps = 0
-                    while can_move:
-                        any_inside = False
-                        for v in subset_voxels:
-                            vv = v.move(d, steps + 1)
-                            if vv in old_voxels:
-                                can_move = False
-                                break
-
-                            if vv.is_inside():
-                                any_inside = True
-
-                        if can_move:
-                            steps += 1
-                            if not any_inside:
-                                is_outside = True
-                                break
-
-                    if steps:
-                        if not is_outside:
-                            # If the pieces are still in the puzzle we have
-                            # to go by a single step
-                            steps = 1
-
-                        move = Move(set(subset), d.value, steps)
-                        states.append((move, self.move(move).state()))
+        subsets = _subsets(len(self.pieces), len(self.shapes))
+        for piece_mask, d, steps in _valid_moves_kernel(self.masks, subsets):
+            move = Move(piece_mask, d.value, steps)
+            states.append((move, self.move(move).state()))
 
         return states
 
@@ -166,14 +320,14 @@ class Puzzle(NamedTuple("Puzzle", [("shapes", Tuple[Shape]),
         """Create a puzzle state from a string representation."""
         parts = text.split()
         pieces = []
-        voxels = set()
+        voxels = 0
 
         for part in parts:
             place = part[0]
             s = int(part[1]) - 1
             n = ord(part[2]) - 97
             piece = Piece(s, PLACES[place], n)
-            voxels.update(self.voxels_for(piece))
+            voxels |= self.mask_for(piece)
             pieces.append(piece)
 
         return PuzzleState(tuple(pieces), voxels)
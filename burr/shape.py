@@ -1,11 +1,13 @@
 """Shape class for the burr puzzle."""
 
-from functools import lru_cache
-from typing import List, Mapping, NamedTuple, Set, Tuple
+from collections import Counter
+from typing import Dict, List, Mapping, NamedTuple, Tuple
+
+import numpy as np
 
 from .piece import Piece
-from .position import PLACES, Position
-from .voxel import Voxel
+from .position import PLACE_INDEX, PLACES, Position
+from .voxel import INSIDE_MASK, move_voxels_to, Voxel, voxels_to_mask
 
 
 """Voxels required for a piece orientation to be valid."""
@@ -36,88 +38,115 @@ REQUIRED = {
           Voxel(0, 1, 2), Voxel(0, 1, 1)],
 }
 
+"""Occupancy bitmask of the voxels required at each named location."""
+REQUIRED_MASKS = {name: voxels_to_mask(voxels) for name, voxels in REQUIRED.items()}
+
 
 class Vec3(NamedTuple("Vec3", [("x", float), ("y", float), ("z", float)])):
     """Simple class representing a 3D vector."""
 
-    def __add__(self, other: "Vec3") -> "Vec3":
-        """Adds two vectors together."""
-        return Vec3(self.x + other.x, self.y + other.y, self.z + other.z)
 
-    def __lt__(self, other: "Vec3") -> "Vec3":
-        """Tests whether one vector is less than another."""
-        if self.x < other.x:
-            return True
+"""An integer vertex in an STL mesh."""
+Vertex = Tuple[int, int, int]
 
-        if self.x == other.x:
-            if self.y < other.y:
-                return True
 
-            if self.y == other.y:
-                if self.z < other.z:
-                    return True
+class Facet(NamedTuple("Facet", [("normal", Vec3), ("loop", Tuple[Vertex, Vertex, Vertex])])):
+    """A facet (triangle) in an STL mesh."""
 
-        return False
+    def to_text(self) -> str:
+        """Return the facet in the STL text format."""
+        normal = self.normal
+        (ax, ay, az), (bx, by, bz), (cx, cy, cz) = self.loop
+        return (f"facet normal {normal.x} {normal.y} {normal.z}\n"
+                "  outer loop\n"
+                f"    vertex {ax} {ay} {az}\n"
+                f"    vertex {bx} {by} {bz}\n"
+                f"    vertex {cx} {cy} {cz}\n"
+                "  endloop\n"
+                "endfacet\n")
 
-    def to_int(self, scale: int) -> "Vec3":
-        """Casts all values to ints."""
-        return Vec3(int(self.x) * scale, int(self.y) * scale, int(self.z) * scale)
 
+"""A valid orientation of a shape and the occupancy bitmask of its aligned voxels."""
+VoxelState = NamedTuple("VoxelState", [("orientation", int), ("mask", int)])
 
-class Facet(NamedTuple("Facet", [("normal", Vec3), ("loop", Tuple[Vec3, Vec3, Vec3])])):
-    """A facet (triangle) in an STL mesh."""
 
-    def write(self, file) -> str:
-        """Write the facet to an STL file."""
-        file.write(f"facet normal {self.normal.x} {self.normal.y} {self.normal.z}\n")
-        file.write("  outer loop\n")
-        for v in self.loop:
-            file.write(f"    vertex {v.x} {v.y} {v.z}\n")
-        file.write("  endloop\n")
-        file.write("endfacet\n")
+def align_voxels(xyz: np.ndarray,
+                 position: Position,
+                 orientation: int) -> Tuple[Voxel, ...]:
+    """Align the voxels to grid at the piece position and orientation.
 
+    Args:
+        xyz: The (N, 3) voxel coordinates centered around the origin.
+        position: The position of the piece.
+        orientation: The orientation of the piece.
 
-VoxelState = NamedTuple("VoxelState", [("orientation", int), ("voxels", Set[Voxel])])
+    Returns:
+        The aligned voxels.
+    """
+    aligned = np.floor(move_voxels_to(xyz, position, orientation)).astype(np.int64)
+    return tuple([Voxel(vx, vy, vz) for vx, vy, vz in aligned.tolist()])
 
 
-@lru_cache(maxsize=None)
-def align_voxels(voxels: Tuple[Voxel],
-                 position: Position,
-                 orientation: int) -> Tuple[Voxel, ...]:
-    """Align the voxels to grid at the piece position and orientation."""
-    return tuple([v.move_to(position, orientation).align()
-                  for v in voxels])
+def align_loose(voxels: Tuple[Voxel],
+                position: Position,
+                orientation: int) -> Tuple[Tuple[Voxel, ...], int]:
+    """Align the voxels at a position which is not a named location.
+
+    Returns:
+        The aligned voxels and their occupancy bitmask.
+    """
+    aligned = align_voxels(np.array(voxels), position, orientation)
+    return aligned, voxels_to_mask(aligned)
 
 
 class Shape(NamedTuple("Shape", [("voxels", Tuple[Voxel, ...]),
                                  ("orientations",
-                                  Mapping[str, List[VoxelState]])])):
+                                  Mapping[str, List[VoxelState]]),
+                                 ("mask", int),
+                                 ("aligned", Tuple[Tuple[Tuple[Voxel, ...], ...], ...]),
+                                 ("aligned_masks", Tuple[Tuple[int, ...], ...]),
+                                 ("size", int),
+                                 ("num_orientations", int),
+                                 ("loose", Dict[Piece, Tuple[Tuple[Voxel, ...], int]])])):
     """A shape in the puzzle.
 
-    Consists of a list of voxels centered around the origin and a mapping of
-    valid orientations for this shape at each named location in the puzzle.
+    Consists of a list of voxels centered around the origin, a mapping of
+    valid orientations for this shape at each named location in the puzzle
+    and the occupancy bitmask of its voxels once aligned to the grid. The
+    aligned voxels and bitmasks for every orientation at each named location
+    are precomputed, indexed by place index and then orientation. The number
+    of voxels and the number of valid orientations are stored for ordering
+    the shapes.
+
+    Pieces only leave the named locations while the puzzle is being
+    disassembled, so alignments at other positions are cached in ``loose``
+    as they are encountered, keyed by the piece.
     """
 
     def aligned_at(self, p: Piece) -> "Shape":
         """Return the shape with its voxels aligned to the grid for the given piece."""
-        return Shape(align_voxels(self.voxels, p.position, p.orientation), self.orientations)
+        i = PLACE_INDEX.get(p.position)
+        if i is None:
+            aligned = self.loose.get(p)
+            if aligned is None:
+                aligned = align_loose(self.voxels, p.position, p.orientation)
+                self.loose[p] = aligned
+
+            voxels, mask = aligned
+        else:
+            voxels = self.aligned[i][p.orientation]
+            mask = self.aligned_masks[i][p.orientation]
+
+        return Shape(voxels, self.orientations, mask, self.aligned, self.aligned_masks,
+                     self.size, self.num_orientations, self.loose)
 
     def inside_count(self) -> int:
         """Return the number of voxels inside the puzzle."""
-        count = len(self.voxels)
-        for v in self.voxels:
-            if v.x < -2 or v.x > 2 or v.y < -2 or v.y > 2 or v.z < -2 or v.z > 2:
-                count -= 1
-
-        return count
+        return (self.mask & INSIDE_MASK).bit_count()
 
     def is_inside(self) -> bool:
         """Return whether some voxels are inside the puzzle."""
-        for v in self.voxels:
-            if v.is_inside():
-                return True
-
-        return False
+        return (self.mask & INSIDE_MASK) != 0
 
     @staticmethod
     def from_text(text: str) -> "Shape":
@@ -130,7 +159,7 @@ class Shape(NamedTuple("Shape", [("voxels", Tuple[Voxel, ...]),
         xxxxxx/xx..xx/x..xxx/x...xx
         """
         lines = text.split("/")
-        shape_voxels: List[Voxel] = []
+        shape_voxels = []
         for i, line in enumerate(lines):
             x = i % 2
             y = i // 2
@@ -139,35 +168,42 @@ class Shape(NamedTuple("Shape", [("voxels", Tuple[Voxel, ...]),
                     voxel = Voxel(x - 0.5, y - 0.5, 2.5 - z)
                     shape_voxels.append(voxel)
 
+        shape_voxels = tuple(shape_voxels)
+        xyz = np.array(shape_voxels)
+        aligned = tuple(tuple(align_voxels(xyz, place, o) for o in range(8))
+                        for place in PLACES.values())
+        aligned_masks = tuple(tuple(voxels_to_mask(voxels) for voxels in place_voxels)
+                              for place_voxels in aligned)
+
         valid_orientations = {}
-        s = Shape(tuple(shape_voxels), valid_orientations)
-        for name, place in PLACES.items():
-            orientation_voxels = set()
-            orientations: Mapping[int, Tuple[Voxel, ...]] = {}
-            for o in range(8):
-                piece = Piece(0, place, o)
-                voxels = tuple(sorted(s.aligned_at(piece).voxels))
-                if voxels not in orientation_voxels:
-                    orientation_voxels.add(voxels)
-                    num_req = len(set(voxels).intersection(REQUIRED[name]))
+        for name, place_masks in zip(PLACES, aligned_masks):
+            orientation_masks = set()
+            orientations: Mapping[int, int] = {}
+            for o, mask in enumerate(place_masks):
+                if mask not in orientation_masks:
+                    orientation_masks.add(mask)
+                    num_req = (mask & REQUIRED_MASKS[name]).bit_count()
                     if num_req == 8:
-                        orientations[o] = set(voxels)
+                        orientations[o] = mask
 
-            valid_orientations[name] = [VoxelState(o, vs) for o, vs in orientations.items()]
+            valid_orientations[name] = [VoxelState(o, mask) for o, mask in orientations.items()]
 
-        return s
+        return Shape(shape_voxels, valid_orientations,
+                     voxels_to_mask(np.floor(xyz).astype(np.int64).tolist()),
+                     aligned, aligned_masks,
+                     len(shape_voxels), len(valid_orientations["A"]), {})
 
     def save_as_stl(self, path: str, scale=10):
         """Save this shape as an STL file."""
         cube_vertices = [
-            Vec3(-0.5, 0.5, -0.5),
-            Vec3(-0.5, 0.5, 0.5),
-            Vec3(0.5, 0.5, 0.5),
-            Vec3(0.5, 0.5, -0.5),
-            Vec3(-0.5, -0.5, -0.5),
-            Vec3(-0.5, -0.5, 0.5),
-            Vec3(0.5, -0.5, 0.5),
-            Vec3(0.5, -0.5, -0.5)
+            (-0.5, 0.5, -0.5),
+            (-0.5, 0.5, 0.5),
+            (0.5, 0.5, 0.5),
+            (0.5, 0.5, -0.5),
+            (-0.5, -0.5, -0.5),
+            (-0.5, -0.5, 0.5),
+            (0.5, -0.5, 0.5),
+            (0.5, -0.5, -0.5)
         ]
         cube_normals = [
             Vec3(0, 1, 0),
@@ -187,33 +223,20 @@ class Shape(NamedTuple("Shape", [("voxels", Tuple[Voxel, ...]),
         ]
 
         facets = []
-        for v in self.voxels:
-            center = Vec3(v.x, v.y, v.z)
+        for vx, vy, vz in self.voxels:
+            vertices = [(int(x + vx) * scale, int(y + vy) * scale, int(z + vz) * scale)
+                        for x, y, z in cube_vertices]
             for i, (a, b, c) in enumerate(cube_triangles):
-                normal = cube_normals[i // 2]
-                loop = [cube_vertices[a] + center,
-                        cube_vertices[b] + center,
-                        cube_vertices[c] + center]
-                facets.append(Facet(normal, tuple([v.to_int(scale) for v in loop])))
-
-        # remove duplicate facets
-        facets.sort()
-        num_removed = 0
-        dedup = {}
-        for facet in facets:
-            key = tuple(sorted(facet.loop))
-            if key in dedup:
-                num_removed += 2
-                del dedup[key]
-            else:
-                dedup[key] = facet
-
-        facets = list(dedup.values())
+                loop = (vertices[a], vertices[b], vertices[c])
+                facets.append(Facet(cube_normals[i // 2], loop))
+
+        # remove duplicate facets, which are shared by two neighboring voxels
+        keys = [frozenset(facet.loop) for facet in facets]
+        counts = Counter(keys)
+        facets = [facet for facet, key in zip(facets, keys) if counts[key] == 1]
 
         # TODO add give
 
+        text = "".join([facet.to_text() for facet in facets])
         with open(path, "w") as file:
-            file.write("solid burr_piece\n")
-            for facet in facets:
-                facet.write(file)
-            file.write("endsolid")
+            file.write(f"solid burr_piece\n{text}endsolid")
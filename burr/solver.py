@@ -1,21 +1,27 @@
 """Solver for the Burr puzzle."""
 
 import heapq
-import sys
-from typing import List, Mapping, Set, Tuple
+from itertools import count
+from typing import List, Mapping, Tuple
 
-from .piece import Piece
+from .position import PLACE_INDEX, PLACES
 from .puzzle import Move, Puzzle, PuzzleState
 
 
-def reconstruct_path(came_from: Mapping[PuzzleState, Tuple[PuzzleState, Move]],
+"""The named locations to fill after the first piece, as a bitmap of place indices."""
+_REMAINING_PLACES = ((1 << len(PLACES)) - 1) & ~(1 << PLACE_INDEX[PLACES["A"]])
+
+
+def reconstruct_path(info: Mapping[Tuple[int, ...], Tuple[int, PuzzleState, PuzzleState, Move]],
                      current: PuzzleState) -> List[Tuple[PuzzleState, Move]]:
     """Reconsruct the optimal path."""
     total_path = [(current, None)]
 
-    while current.pieces in came_from:
-        current, move = came_from[current.pieces]
+    _, _, parent, move = info[current.key()]
+    while parent is not None:
+        current = parent
         total_path.append((current, move))
+        _, _, parent, move = info[current.key()]
 
     total_path.reverse()
     return total_path
@@ -25,33 +31,38 @@ def disassemble(puzzle: Puzzle) -> List[Tuple[PuzzleState, Move]]:
     """Disassemble the puzzle using A* search.
 
     For more information on A* see: https://en.wikipedia.org/wiki/A*_search_algorithm
+
+    Each state reached is recorded once as a (g score, state, parent state, move)
+    tuple, so every neighbor costs a single dictionary lookup. States are pushed
+    again whenever a shorter path to them is found, and the stale entries left
+    in the open set are skipped when they are popped. Ties in the open set are
+    broken by the order in which states were pushed.
     """
     start = puzzle.state()
-    came_from = {}
-    g_score = {start.pieces: 0}
-    f_score = {start.pieces: puzzle.score()}
-    states = {start.pieces: start}
-    open_set = [(f_score[start.pieces], None, start.pieces)]
+    start_key = start.key()
+    info = {start_key: (0, start, None, None)}
+    counter = count()
+    open_set = [(puzzle.score(), next(counter), start_key, 0)]
 
     while open_set:
-        _, _, current = heapq.heappop(open_set)
-        state = states[current]
+        _, _, current, pushed_g_score = heapq.heappop(open_set)
+        g_score, state, _, _ = info[current]
+        if pushed_g_score != g_score:
+            continue
+
         if len(current) == 0:
-            return reconstruct_path(came_from, state)
+            return reconstruct_path(info, state)
 
         new_puzzle = puzzle.to_state(state)
-        del states[current]
+        tentative_g_score = g_score + 1
         for move, neighbor in new_puzzle.valid_moves():
-            tentative_g_score = g_score[current] + 1
-            if tentative_g_score < g_score.get(neighbor.pieces, sys.maxsize):
-                came_from[neighbor.pieces] = (state, move)
-                g_score[neighbor.pieces] = tentative_g_score
-                score = new_puzzle.to_state(neighbor).score()
-                f_score[neighbor.pieces] = g_score[neighbor.pieces] + score
-                if neighbor not in open_set:
-                    states[neighbor.pieces] = neighbor
-                    heapq.heappush(
-                        open_set, (f_score[neighbor.pieces], move, neighbor.pieces))
+            key = neighbor.key()
+            entry = info.get(key)
+            if entry is None or tentative_g_score < entry[0]:
+                info[key] = (tentative_g_score, neighbor, state, move)
+                score = neighbor.score()
+                heapq.heappush(open_set, (tentative_g_score + score, next(counter), key,
+                                          tentative_g_score))
 
     return None
 
@@ -70,24 +81,25 @@ def solve(puzzle: Puzzle) -> List[Tuple[PuzzleState, Move]]:
     # The remaining pieces are ordered by the number of valid orientations
     # which will limit branching
     remaining = [s for s in puzzle.order_by_orientations() if s != first]
-    frontier: List[Tuple[int, PuzzleState, Set[Piece]]] = []
 
-    # Add the first piece to the frontier at all
-    # valid orientations
-    for top, voxels in puzzle.pieces_at(first, "A"):
-        if top.is_flipped():
-            # These solutions will be rotations of other solutions
-            continue
+    # The shapes and named locations which are still to be filled are
+    # tracked as bitmaps of their indices
+    remaining_bits = sum(1 << s for s in remaining)
+    counter = count()
+    frontier: List[Tuple[int, int, PuzzleState, int, int]] = []
 
-        heapq.heappush(frontier, (len(remaining), PuzzleState((top,), voxels),
-                                  set(remaining),
-                                  {"B", "C", "D", "E", "F"}))
+    # Add the first piece to the frontier at all valid orientations
+    # which are not flipped, as flipped orientations will give
+    # rotations of other solutions
+    for top, mask in puzzle.pieces_at_unflipped(first, "A"):
+        heapq.heappush(frontier, (len(remaining), next(counter), PuzzleState((top,), mask),
+                                  remaining_bits, _REMAINING_PLACES))
 
     num_checked = 0
     solution = None
     while frontier:
-        _, state, s_pieces, s_places = heapq.heappop(frontier)
-        if len(s_pieces) == 0:
+        num_remaining, _, state, s_pieces, s_places = heapq.heappop(frontier)
+        if num_remaining == 0:
             # Found a valid assembly, now try to disassemble
             num_checked += 1
             puzzle = puzzle.to_state(state)
@@ -97,14 +109,21 @@ def solve(puzzle: Puzzle) -> List[Tuple[PuzzleState, Move]]:
 
             continue
 
-        for s in s_pieces:
-            for place in s_places:
-                for new_piece, new_voxels in puzzle.pieces_at(s, place):
-                    if state.voxels.isdisjoint(new_voxels):
-                        new_state = state.add(new_piece, new_voxels)
-                        new_s_pieces = s_pieces - set([s])
-                        new_s_places = s_places - set([place])
-                        heapq.heappush(frontier, (len(new_s_pieces),
+        for s in range(len(puzzle.shapes)):
+            if not (s_pieces >> s) & 1:
+                continue
+
+            new_s_pieces = s_pieces & ~(1 << s)
+            for i, placements in enumerate(puzzle.placements[s]):
+                if not (s_places >> i) & 1:
+                    continue
+
+                new_s_places = s_places & ~(1 << i)
+                for new_piece, new_mask in placements:
+                    if (state.voxels & new_mask) == 0:
+                        new_state = state.add(new_piece, new_mask)
+                        heapq.heappush(frontier, (num_remaining - 1,
+                                                  next(counter),
                                                   new_state,
                                                   new_s_pieces,
                                                   new_s_places))
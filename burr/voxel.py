@@ -1,17 +1,19 @@
 """Voxel class and functions to create a mesh from a list of voxels."""
 
 import math
-from typing import List, NamedTuple
+from typing import Iterable, List, NamedTuple, Tuple
 
 import numpy as np
 import scenepic as sp
 
-from .position import Axis, Direction, Position
+from .position import AXES, Axis, DELTAS, Direction, Position
 
 
 class Voxel(NamedTuple("Voxel", [("x", float), ("y", float), ("z", float)])):
     """A voxel in the puzzle."""
 
+    __slots__ = ()
+
     def move(self, d: Direction, steps=1) -> "Voxel":
         """Move the voxel in the given direction.
 
@@ -22,25 +24,8 @@ class Voxel(NamedTuple("Voxel", [("x", float), ("y", float), ("z", float)])):
         Returns:
             The result of moving the voxel.
         """
-        if d == Direction.UP:
-            return Voxel(self.x, self.y + steps, self.z)
-
-        if d == Direction.DOWN:
-            return Voxel(self.x, self.y - steps, self.z)
-
-        if d == Direction.LEFT:
-            return Voxel(self.x - steps, self.y, self.z)
-
-        if d == Direction.RIGHT:
-            return Voxel(self.x + steps, self.y, self.z)
-
-        if d == Direction.FORWARD:
-            return Voxel(self.x, self.y, self.z + steps)
-
-        if d == Direction.BACKWARD:
-            return Voxel(self.x, self.y, self.z - steps)
-
-        raise ValueError("Invalid direction")
+        dx, dy, dz = DELTAS[d]
+        return Voxel(self.x + dx * steps, self.y + dy * steps, self.z + dz * steps)
 
     def move_to(self, p: Position, n: int) -> "Voxel":
         """Move the voxel to a new position.
@@ -98,6 +83,166 @@ class Voxel(NamedTuple("Voxel", [("x", float), ("y", float), ("z", float)])):
         return f"({self.x}, {self.y}, {self.z})"
 
 
+def _rotation(axis: Axis, orientation: int) -> np.ndarray:
+    """Compute the rotation applied to voxels along an axis in the given orientation."""
+    n = orientation
+    rotation = np.eye(3, dtype=np.int8)
+    if n > 3:
+        n -= 4
+        rotation = np.diag([-1, 1, -1]).astype(np.int8)
+
+    quarter_turn = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]], np.int8)
+    for _ in range(n):
+        rotation = quarter_turn @ rotation
+
+    if axis == Axis.Y:
+        rotation = np.array([[1, 0, 0], [0, 0, -1], [0, 1, 0]], np.int8) @ rotation
+
+    if axis == Axis.X:
+        rotation = np.array([[0, 0, 1], [0, 1, 0], [-1, 0, 0]], np.int8) @ rotation
+
+    return rotation
+
+
+"""Rotation applied to voxels, indexed by axis and then orientation."""
+ROTATIONS = np.stack([np.stack([_rotation(axis, o) for o in range(8)]) for axis in AXES])
+
+
+def move_voxels_to(xyz: np.ndarray, p: Position, n: int) -> np.ndarray:
+    """Move a batch of voxels to a new position.
+
+    This is equivalent to calling Voxel.move_to on every voxel, but
+    applies a single matrix product to all of them at once.
+
+    Args:
+        xyz: The (N, 3) voxel coordinates.
+        p: The new position to move the voxels to.
+        n: The orientation of the piece.
+
+    Returns:
+        The (N, 3) coordinates of the voxels after moving.
+    """
+    x, y, z, axis = p
+    return xyz @ ROTATIONS[AXES.index(axis), n].T + (x, y, z)
+
+
+"""Number of cells along each axis of the occupancy grid.
+
+Pieces slide well beyond the 6x6x6 core of the puzzle while it is being
+disassembled, so the grid spans [-8, 8) along each axis.
+"""
+GRID_SIZE = 16
+GRID_OFFSET = GRID_SIZE // 2
+
+"""Bit stride of a single step along the X, Y and Z axes."""
+STRIDES = (1, GRID_SIZE, GRID_SIZE * GRID_SIZE)
+
+
+def voxel_index(x: int, y: int, z: int) -> int:
+    """Return the bit index of an aligned voxel in the occupancy grid."""
+    return ((x + GRID_OFFSET) * STRIDES[0] + (y + GRID_OFFSET) * STRIDES[1]
+            + (z + GRID_OFFSET) * STRIDES[2])
+
+
+def in_grid(x: int, y: int, z: int) -> bool:
+    """Check if an aligned voxel lies within the occupancy grid."""
+    return (-GRID_OFFSET <= x < GRID_OFFSET and -GRID_OFFSET <= y < GRID_OFFSET
+            and -GRID_OFFSET <= z < GRID_OFFSET)
+
+
+def voxels_to_mask(voxels: Iterable[Voxel]) -> int:
+    """Pack a collection of aligned voxels into an occupancy bitmask.
+
+    Voxels which fall outside of the grid are far outside of the puzzle
+    and are ignored.
+    """
+    mask = 0
+    for x, y, z in voxels:
+        if in_grid(x, y, z):
+            mask |= 1 << voxel_index(x, y, z)
+
+    return mask
+
+
+def _plane_mask(axis: int, index: int) -> int:
+    """Return the mask of all cells with the given index along an axis."""
+    mask = 0
+    others = [STRIDES[a] for a in range(3) if a != axis]
+    for i in range(GRID_SIZE):
+        for j in range(GRID_SIZE):
+            mask |= 1 << (index * STRIDES[axis] + i * others[0] + j * others[1])
+
+    return mask
+
+
+"""Masks of the planes of cells along each axis."""
+_PLANES = [[_plane_mask(axis, i) for i in range(GRID_SIZE)] for axis in range(3)]
+
+
+def _slab_mask(axis: int, lower: int, upper: int) -> int:
+    """Return the mask of all cells with an axis index in [lower, upper)."""
+    mask = 0
+    for plane in _PLANES[axis][lower:upper]:
+        mask |= plane
+
+    return mask
+
+
+"""Mask of all cells inside the puzzle."""
+INSIDE_MASK = voxels_to_mask(Voxel(x, y, z)
+                             for x in range(-2, 3)
+                             for y in range(-2, 3)
+                             for z in range(-2, 3))
+
+
+def _direction_axis(d: Direction) -> Tuple[int, int]:
+    """Return the axis and sign of a direction."""
+    delta = DELTAS[d]
+    axis = 0 if delta[0] else 1 if delta[1] else 2
+    return axis, delta[axis]
+
+
+def _clip_mask(d: Direction, steps: int) -> int:
+    """Return the mask of the cells which stay within the grid after moving."""
+    axis, sign = _direction_axis(d)
+    if sign > 0:
+        return _slab_mask(axis, 0, GRID_SIZE - steps)
+
+    return _slab_mask(axis, steps, GRID_SIZE)
+
+
+"""Signed bit shift of a single step in each direction, indexed by direction."""
+SHIFTS = tuple(sign * STRIDES[axis] for axis, sign in map(_direction_axis, Direction))
+
+"""Masks of the cells which stay within the grid after moving.
+
+Indexed by direction and then the number of steps.
+"""
+CLIPS = tuple(tuple(_clip_mask(d, n) for n in range(GRID_SIZE)) for d in Direction)
+
+
+def shift_mask(mask: int, d: Direction, steps=1) -> int:
+    """Move all voxels in an occupancy bitmask in the given direction.
+
+    Args:
+        mask: The occupancy bitmask.
+        d: The direction to move the voxels.
+        steps: The number of steps to move the voxels.
+
+    Returns:
+        The moved bitmask. Voxels which leave the grid are dropped.
+    """
+    if steps >= GRID_SIZE:
+        return 0
+
+    shift = SHIFTS[d] * steps
+    mask &= CLIPS[d][steps]
+    if shift > 0:
+        return mask << shift
+
+    return mask >> -shift
+
+
 def voxels_to_mesh(scene: sp.Scene, voxels: List[Voxel],
                    name="voxels", color=sp.Colors.White) -> sp.Mesh:
     """Create a mesh from a list of voxels.
@@ -113,10 +258,6 @@ def voxels_to_mesh(scene: sp.Scene, voxels: List[Voxel],
     """
     mesh = scene.create_mesh(name, layer_id=name)
     mesh.add_cube(color)
-    positions = []
-    for voxel in voxels:
-        positions.append([voxel.x, voxel.y, voxel.z])
-
-    positions = np.array(positions, np.float32)
+    positions = np.array(voxels, np.float32).reshape(-1, 3)
     mesh.enable_instancing(positions)
     return mesh
@@ -4,10 +4,15 @@ For more information on burr puzzles, see: https://en.wikipedia.org/wiki/Burr_pu
 """
 
 import argparse
+import hashlib
 import json
-from typing import List, Tuple
+import os
+import pickle
+import tempfile
+from typing import Iterator, List, Tuple
 
 from burr import disassemble, Move, Puzzle, PuzzleState, solve, voxels_to_mesh
+import numpy as np
 import scenepic as sp
 
 
@@ -20,6 +25,10 @@ def parse_args():
                         help="Known assembly to use")
     parser.add_argument("--stl", "-s", action="store_true",
                         help="Write out shapes as STL files")
+    parser.add_argument("--no-html", action="store_true",
+                        help="Do not write out the solution as a ScenePic HTML file")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Solve the puzzle even if a cached solution exists")
     parser.add_argument("--sp-width", type=int, default=900,
                         help="Width of the ScenePic solution")
     parser.add_argument("--sp-height", type=int, default=600,
@@ -27,11 +36,95 @@ def parse_args():
     return parser.parse_args()
 
 
+"""Scale and color of the bounding box of the pieces along each axis."""
+CROSS_CUBES = [([6, 2, 4], sp.Colors.Red),
+               ([4, 6, 2], sp.Colors.Green),
+               ([2, 4, 6], sp.Colors.Blue)]
+
+"""Directory in which solutions are cached between runs."""
+CACHE_DIR = ".burr_cache"
+
+"""Version of the cached solution format, to be bumped whenever Move or PuzzleState change."""
+CACHE_VERSION = 1
+
 """Colors for each piece."""
 COLORS = [sp.Colors.Red, sp.Colors.Green, sp.Colors.Blue,
           sp.Colors.Yellow, sp.Colors.Cyan, sp.Colors.Magenta]
 
 
+def solve_cached(puzzle: Puzzle, shapes: List[str],
+                 use_cache=True) -> List[Tuple[PuzzleState, Move]]:
+    """Solve the puzzle, reusing the solution from a previous run with the same shapes.
+
+    A cached solution which cannot be loaded is ignored and the puzzle is
+    solved again. Solutions are written to a temporary file first, so an
+    interrupted run never leaves a partial solution in the cache.
+    """
+    key = hashlib.sha1(json.dumps([CACHE_VERSION, shapes]).encode("utf-8")).hexdigest()
+    path = os.path.join(CACHE_DIR, f"{key}.pkl")
+    if use_cache and os.path.exists(path):
+        try:
+            with open(path, "rb") as file:
+                return pickle.load(file)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            print("Ignoring unreadable cached solution", path)
+
+    disassembly = solve(puzzle)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile("wb", dir=CACHE_DIR, suffix=".tmp", delete=False) as file:
+        try:
+            pickle.dump(disassembly, file)
+        except BaseException:
+            file.close()
+            os.remove(file.name)
+            raise
+
+    os.replace(file.name, path)
+    return disassembly
+
+
+def static_transforms(state: PuzzleState, move: Move,
+                      meshes: List[sp.Mesh]) -> List[Tuple[sp.Mesh, np.ndarray]]:
+    """Return the mesh and transform of each piece which stays still during a move.
+
+    These can be reused for every frame of the move.
+    """
+    return [(meshes[piece.shape], piece.to_transform())
+            for i, piece in enumerate(state.pieces)
+            if not (move.piece_mask >> i) & 1]
+
+
+def add_move_frames(canvas: sp.Canvas3D, cameras: Iterator[sp.Camera], cross: sp.Mesh,
+                    puzzle: Puzzle, state: PuzzleState, move: Move, meshes: List[sp.Mesh],
+                    steps: np.ndarray):
+    """Add a frame to the canvas for each number of steps along a move.
+
+    Each frame takes the next camera from the iterator.
+    """
+    static = static_transforms(state, move, meshes)
+    moving = [p for i, p in enumerate(state.pieces) if (move.piece_mask >> i) & 1]
+    transforms, is_inside = puzzle.move_batch(moving, move.direction, steps)
+    for frame_transforms, frame_is_inside in zip(transforms, is_inside):
+        frame: sp.Frame3D = canvas.create_frame(camera=next(cameras), meshes=[cross])
+        for mesh, transform in static:
+            frame.add_mesh(mesh, transform)
+
+        for piece, transform, inside in zip(moving, frame_transforms, frame_is_inside):
+            if inside:
+                frame.add_mesh(meshes[piece.shape], transform)
+
+
+def build_cross(scene: sp.Scene) -> sp.Mesh:
+    """Create the wireframe showing the bounds of the three axes of the puzzle."""
+    cross = scene.create_mesh("cross", layer_id="wireframe")
+    for scale, color in CROSS_CUBES:
+        cross.add_cube(transform=sp.Transforms.scale(scale), add_wireframe=True,
+                       fill_triangles=False, color=color)
+
+    cross.add_coordinate_axes()
+    return cross
+
+
 def save_scenepic(path: str, puzzle: Puzzle,
                   disassembly: List[Tuple[PuzzleState, Move]], width: int, height: int):
     """Save the solution as a ScenePic HTML file."""
@@ -47,63 +140,30 @@ def save_scenepic(path: str, puzzle: Puzzle,
         frame = canvas.create_frame()
         frame.add_mesh(mesh)
 
-    cross = scene.create_mesh("cross", layer_id="wireframe")
-    cross.add_cube(transform=sp.Transforms.scale(
-        [6, 2, 4]), add_wireframe=True, fill_triangles=False,
-        color=sp.Colors.Red)
-    cross.add_cube(transform=sp.Transforms.scale(
-        [4, 6, 2]), add_wireframe=True, fill_triangles=False,
-        color=sp.Colors.Green)
-    cross.add_cube(transform=sp.Transforms.scale(
-        [2, 4, 6]), add_wireframe=True, fill_triangles=False,
-        color=sp.Colors.Blue)
-    cross.add_coordinate_axes()
+    cross = build_cross(scene)
     camera.aspect_ratio = width / height
     canvas = scene.create_canvas_3d("solution", width=width, height=height,
                                     camera=camera, shading=shading)
     frames_per_step = 10
-    num_frames = sum([move.steps
-                      for _, move in disassembly[:-1]]) * frames_per_step
+    num_frames = sum(move.steps for _, move in disassembly[:-1]) * frames_per_step
     freeze_frames = 60
-    cameras = sp.Camera.orbit(num_frames + freeze_frames + num_frames, 10, 1, 0, 1,
-                              [0, 1, 0], [0, 0, 1],
-                              60, width / height, .1, 100)
-    f = 0
+    cameras = iter(sp.Camera.orbit(num_frames + freeze_frames + num_frames, 10, 1, 0, 1,
+                                   [0, 1, 0], [0, 0, 1],
+                                   60, width / height, .1, 100))
     for state, move in reversed(disassembly[:-1]):
-        puzzle = puzzle.to_state(state)
-        move_steps = move.steps * frames_per_step
-        for steps in range(move_steps, 0, -1):
-            temp = puzzle.move(Move(move.pieces, move.direction, steps / frames_per_step))
-            frame: sp.Frame3D = canvas.create_frame(camera=cameras[f])
-            f += 1
-            frame.add_mesh(cross)
-            for piece in temp.pieces:
-                mesh = meshes[piece.shape]
-                transform = piece.to_transform()
-                frame.add_mesh(mesh, transform)
-
-    assembled = puzzle.to_state(disassembly[0][0])
+        steps = np.arange(move.steps * frames_per_step, 0, -1) / frames_per_step
+        add_move_frames(canvas, cameras, cross, puzzle, state, move, meshes, steps)
+
+    assembled = disassembly[0][0]
+    static = [(meshes[piece.shape], piece.to_transform()) for piece in assembled.pieces]
     for _ in range(freeze_frames):
-        frame = canvas.create_frame(camera=cameras[f])
-        frame.add_mesh(cross)
-        f += 1
-        for piece in assembled.pieces:
-            mesh = meshes[piece.shape]
-            transform = piece.to_transform()
+        frame = canvas.create_frame(camera=next(cameras), meshes=[cross])
+        for mesh, transform in static:
             frame.add_mesh(mesh, transform)
 
     for state, move in disassembly[:-1]:
-        puzzle = puzzle.to_state(state)
-        move_steps = move.steps * frames_per_step
-        for steps in range(0, move_steps):
-            temp = puzzle.move(Move(move.pieces, move.direction, steps / frames_per_step))
-            frame: sp.Frame3D = canvas.create_frame(camera=cameras[f])
-            f += 1
-            frame.add_mesh(cross)
-            for piece in temp.pieces:
-                mesh = meshes[piece.shape]
-                transform = piece.to_transform()
-                frame.add_mesh(mesh, transform)
+        steps = np.arange(move.steps * frames_per_step) / frames_per_step
+        add_move_frames(canvas, cameras, cross, puzzle, state, move, meshes, steps)
 
     scene.grid(width=f"{width}px", grid_template_rows=f"{piece_size}px {height}px",
                grid_template_columns=f"repeat(6, {piece_size}px)")
@@ -141,10 +201,11 @@ def main():
         state = puzzle.load_state(assembly)
         disassembly = disassemble(puzzle.to_state(state))
     else:
-        if puzzle.level() > 1:
-            print("Puzzle is level", puzzle.level(), "(Higher levels can result in longer solve times)")
+        level = puzzle.level()
+        if level > 1:
+            print("Puzzle is level", level, "(Higher levels can result in longer solve times)")
 
-        disassembly = solve(puzzle)
+        disassembly = solve_cached(puzzle, shapes, not args.no_cache)
         print("Valid assembly:", disassembly[0][0])
 
     if disassembly:
@@ -152,6 +213,9 @@ def main():
     else:
         print("No disassembly found")
 
+    if args.no_html:
+        return
+
     path = "solution{}.html".format(args.puzzle)
     save_scenepic(path, puzzle, disassembly, args.sp_width, args.sp_height)
     print("View solution: ./solution{}.html".format(args.puzzle))